@@ -3,6 +3,9 @@
 from functools import wraps
 from django.http import Http404, HttpResponseRedirect
 
+from popup_forms import tokens
+from popup_forms.responses import OpenFormResponse
+
 
 def handler(func):
     """Decorator for popup form handling view.
@@ -30,6 +33,11 @@ def handler(func):
     Both `OpenForm` and `CloseForm` have optional `redirect_to`
     argument, specifying the URL to redirect instead of default one.
 
+    If submission tokens are enabled (see `popup_forms.tokens`),
+    duplicate submissions of the same rendered form are not processed:
+    they are redirected to the URL of the original submission. Invalid
+    submissions (returning `OpenFormResponse`) are not remembered.
+
     .. IMPORTANT::
         * View should not render anything (i.e. return `HttpResponse`).
         * If form validation failed, view should return
@@ -43,15 +51,37 @@ def handler(func):
     @wraps(func)
     def wrapper(request, *args, **kwargs):
 
+        # Short-circuit duplicate submission to the original response
+        token = (tokens.tokens_enabled() and request.method == 'POST'
+                 and tokens.get_token(request))
+        if token:
+            redirect_to = tokens.claim(token)
+            if redirect_to is not None:
+                return HttpResponseRedirect(redirect_to or
+                        request.META.get('HTTP_REFERER', '/'))
+
         # Delete old popup form from session
         if 'popup_form' in request.session:
             del request.session['popup_form']
 
         # Process the form and redirect to the next URL
-        response = func(request, *args, **kwargs)
+        try:
+            response = func(request, *args, **kwargs)
+        except Exception:
+            if token:
+                tokens.release(token)
+            raise
         if isinstance(response, HttpResponseRedirect):
+            if token:
+                if isinstance(response, OpenFormResponse):
+                    tokens.release(token)
+                else:
+                    tokens.store(token, response['Location'])
             return response
 
+        if token:
+            tokens.release(token)
+
         # The view should NOT populate form itself!
         if request.method == 'POST':
             raise ValueError('View for processing popup form populates it!')
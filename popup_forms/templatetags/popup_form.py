@@ -4,6 +4,8 @@ from copy import copy
 from django import template
 from django.template.context import RequestContext
 
+from popup_forms import tokens
+
 register = template.Library()
 
 
@@ -223,7 +225,10 @@ class PopupFormNode(template.Node):
         context_vars = {'POPUP_FORM_id': popup_id,
                         'POPUP_FORM_form': form_instance,
                         'POPUP_FORM_action': form_action,
-                        'POPUP_FORM_hide': hide_form}
+                        'POPUP_FORM_hide': hide_form,
+                        'POPUP_FORM_token': (tokens.new_token()
+                                             if tokens.tokens_enabled()
+                                             else None)}
         context = copy(context)
         context.update(context_vars)
         return tpl.render(RequestContext(request, context))
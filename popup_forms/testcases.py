@@ -0,0 +1,192 @@
+"""Test-case helpers enforcing performance budgets for popup pages"""
+
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django import forms, template
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections, reset_queries, DEFAULT_DB_ALIAS
+from django.utils.importlib import import_module
+
+
+class CallCounter(object):
+    """Counts calls of the attribute `name` of the `owner` object.
+
+    The owner could be either class (to count method calls on all of its
+    instances) or module (to count function calls). Nested calls (e.g.
+    overridden method calling the original one) are counted once.
+
+    Used as context manager: the attribute is patched on enter, and
+    restored on exit::
+
+        with CallCounter(SessionStore, 'save') as counter:
+            ...
+        print counter.count
+
+    """
+
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+        self.count = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __enter__(self):
+        original = getattr(self.owner, self.name)
+        self.saved = self.owner.__dict__.get(self.name)
+
+        @wraps(original)
+        def wrapper(*args, **kwargs):
+            depth = getattr(self.local, 'depth', 0)
+            if not depth:
+                with self.lock:
+                    self.count += 1
+            self.local.depth = depth + 1
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.local.depth = depth
+
+        setattr(self.owner, self.name, wrapper)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.saved is None:
+            delattr(self.owner, self.name)
+        else:
+            setattr(self.owner, self.name, self.saved)
+
+
+class PopupStats(object):
+    """Operations counted while rendering page or submitting popup form"""
+
+    FIELDS = ('queries', 'session_reads', 'session_writes',
+              'forms', 'templates', 'bytes')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def exceeded(self, **budget):
+        """Returns list of messages for counters exceeding the budget"""
+        unknown = set(budget) - set(self.FIELDS)
+        if unknown:
+            raise TypeError('Unknown popup budget: {0}'
+                            .format(', '.join(sorted(unknown))))
+        messages = []
+        for field in self.FIELDS:
+            limit = budget.get(field)
+            if limit is not None and getattr(self, field) > limit:
+                messages.append('{0}: {1} (budget {2})'.format(
+                    field, getattr(self, field), limit))
+        return messages
+
+    def __repr__(self):
+        return '<PopupStats {0}>'.format(', '.join(
+            '{0}={1}'.format(field, getattr(self, field))
+            for field in self.FIELDS))
+
+
+@contextmanager
+def count_popup_operations(using=DEFAULT_DB_ALIAS):
+    """Counts DB queries, session reads/writes, form constructions
+    and template loads within the block.
+
+    Yields `PopupStats` instance, filled in when the block exits.
+    Output bytes are not counted here: it's up to the caller to put
+    the length of response content to `stats.bytes`.
+
+    """
+    stats = PopupStats()
+    connection = connections[using]
+    store_class = import_module(settings.SESSION_ENGINE).SessionStore
+
+    # Don't let each request (e.g. redirects followed by the test
+    # client) reset the queries, counted so far
+    old_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    request_started.disconnect(reset_queries)
+    queries_start = len(connection.queries)
+    try:
+        with CallCounter(store_class, 'load') as reads, \
+             CallCounter(store_class, 'save') as writes, \
+             CallCounter(forms.BaseForm, '__init__') as form_inits, \
+             CallCounter(template.Template, '__init__') as templates:
+            yield stats
+    finally:
+        stats.queries = len(connection.queries) - queries_start
+        connection.use_debug_cursor = old_debug_cursor
+        request_started.connect(reset_queries)
+
+    stats.session_reads = reads.count
+    stats.session_writes = writes.count
+    stats.forms = form_inits.count
+    stats.templates = templates.count
+
+
+class PopupBudgetMixin(object):
+    """Mixin for `django.test.TestCase` asserting performance budgets.
+
+    Fails the test, if rendering the page with popup forms, or running
+    popup form submission cycle, takes more than allowed number of::
+
+        :queries:           Database queries
+        :session_reads:     Session loads from session storage
+        :session_writes:    Session saves to session storage
+        :forms:             Form instances constructed
+        :templates:         Templates loaded (compiled)
+        :bytes:             Bytes of the output (final response)
+
+    Budgets that are `None` are not checked.
+
+    Usage::
+
+        class MyPageTest(PopupBudgetMixin, TestCase):
+
+            def test_profile_page(self):
+                self.assertPopupRenderBudget('/profile/5/',
+                                             queries=10, forms=4)
+
+            def test_send_message(self):
+                self.assertPopupSubmitBudget('/messages/send/',
+                                             {'text': ''},
+                                             referer='/profile/5/',
+                                             session_writes=2)
+
+    """
+
+    def _check_popup_budget(self, stats, budget):
+        messages = stats.exceeded(**budget)
+        if messages:
+            self.fail('Popup performance budget exceeded: {0}'
+                      .format('; '.join(messages)))
+        return stats
+
+    def assertPopupRenderBudget(self, path, data=None, using=DEFAULT_DB_ALIAS,
+                                **budget):
+        """Renders page with popup forms by GET request,
+        and asserts the budget. Returns `PopupStats`.
+
+        """
+        with count_popup_operations(using) as stats:
+            response = self.client.get(path, data or {})
+        self.assertEqual(response.status_code, 200)
+        stats.bytes = len(response.content)
+        return self._check_popup_budget(stats, budget)
+
+    def assertPopupSubmitBudget(self, path, data, referer='/',
+                                using=DEFAULT_DB_ALIAS, **budget):
+        """Submits popup form to the `handler`-decorated view, following
+        redirects back to the page (or to success URL), and asserts
+        the budget of the whole cycle. Returns `PopupStats`.
+
+        """
+        with count_popup_operations(using) as stats:
+            response = self.client.post(path, data, follow=True,
+                                        HTTP_REFERER=referer)
+        self.assertEqual(response.status_code, 200)
+        stats.bytes = len(response.content)
+        return self._check_popup_budget(stats, budget)
@@ -3,18 +3,22 @@
 from unittest import skip
 
 from django import test, forms
+from django.conf import settings
 from django.conf.urls.defaults import patterns, url
+from django.db import connection
 from django.http import HttpResponse
 from django.shortcuts import render
 
+import threading
+
 import popup_forms
 from django.core.urlresolvers import reverse
+from popup_forms import tokens
+from popup_forms.testcases import PopupBudgetMixin
 
 try:
     from django.test.utils import override_settings
 except ImportError:
-    from django.conf import settings
-
     def override_settings(**kwargs):
         for key, value in kwargs.iteritems():
             setattr(settings, key, value)
@@ -48,6 +52,30 @@ def process_form(request):
     return popup_forms.CloseFormResponse(request)
 
 
+@popup_forms.handler
+def query_form(request):
+    """Runs few database queries, and closes the form"""
+    cursor = connection.cursor()
+    for i in range(3):
+        cursor.execute('SELECT 1')
+    return popup_forms.CloseFormResponse(request)
+
+
+FAILED_ONCE = []
+
+
+@popup_forms.handler
+def flaky_form(request):
+    """Fails on the first call, processes the form afterwards"""
+    if not FAILED_ONCE:
+        FAILED_ONCE.append(True)
+        raise RuntimeError('Temporary failure')
+    form = PopupForm(request.POST)
+    form.is_valid()
+    request.session['stored_data'] = form.save()
+    return popup_forms.CloseFormResponse(request, reverse('success'))
+
+
 def success(request):
     return HttpResponse(request.session.pop('stored_data', 'No data'))
 
@@ -56,6 +84,8 @@ urlpatterns = patterns('',
     url(r'^$', index, name='index'),
     url(r'^render_form/$', render_form, name='render_form'),
     url(r'^process_form/$', process_form, name='process_form'),
+    url(r'^query_form/$', query_form, name='query_form'),
+    url(r'^flaky_form/$', flaky_form, name='flaky_form'),
     url(r'^success/$', success, name='success'),
 )
 
@@ -104,6 +134,154 @@ class TestPopupForm(test.TestCase):
                             'name="email" value="wrongemail" maxlength="20" />')
 
 
+@override_settings(POPUP_FORMS=('popup_forms.tests.PopupForm',))
+class TestPopupBudget(PopupBudgetMixin, test.TestCase):
+    """Unit-testing performance budgets of popup forms"""
+
+    urls = 'popup_forms.tests'
+
+    def test_render_budget(self):
+        """Rendering page with popup form should fit into the budget"""
+        # The form is constructed twice: `template.Variable` calls
+        # the form class when resolving it, then the tag instantiates it
+        stats = self.assertPopupRenderBudget('/render_form/',
+                    queries=1, session_reads=1, session_writes=0,
+                    forms=2, templates=3, bytes=4096)
+        self.assertEqual(stats.forms, 2)
+        self.assertTrue(stats.bytes > 0)
+
+    def test_submit_budget(self):
+        """Submit cycle with errors should fit into the budget"""
+        stats = self.assertPopupSubmitBudget('/process_form/',
+                    {'name': 'David', 'email': 'wrongemail'},
+                    referer='/render_form/',
+                    session_reads=2, session_writes=2,
+                    forms=4, templates=3)  # 1 on POST, 3 on re-populating
+        self.assertTrue(stats.session_writes > 0)
+
+    def test_budget_exceeded(self):
+        """Exceeding the budget should fail the test"""
+        self.assertRaises(self.failureException,
+                          self.assertPopupRenderBudget,
+                          '/render_form/', forms=0)
+
+    def test_submit_queries(self):
+        """Queries of all requests in submit cycle should be counted"""
+        stats = self.assertPopupSubmitBudget('/query_form/', {},
+                                             referer='/render_form/')
+        self.assertTrue(stats.queries >= 3)
+        self.assertRaises(self.failureException,
+                          self.assertPopupSubmitBudget,
+                          '/query_form/', {}, referer='/render_form/',
+                          queries=2)
+
+    def test_unknown_budget(self):
+        """Misspelled budget should raise an error, not be ignored"""
+        self.assertRaises(TypeError, self.assertPopupRenderBudget,
+                          '/render_form/', query=10)
+
+
+@override_settings(POPUP_FORMS=('popup_forms.tests.PopupForm',),
+                   POPUP_FORMS_TOKEN=True)
+class TestSubmissionToken(test.TestCase):
+    """Unit-testing dropping of duplicate popup form submissions"""
+
+    urls = 'popup_forms.tests'
+
+    def test_render_token(self):
+        """Form should be rendered with submission token"""
+        response = self.client.get('/render_form/')
+        self.assertContains(response, 'name="popup_form_token"')
+
+    def test_duplicate_submit(self):
+        """Duplicate submission should be redirected without processing"""
+        data = {'name': 'David', 'email': 'avsd05@gmail.com',
+                'popup_form_token': '0123456789abcdef0123456789abcdef'}
+        response = self.client.post('/process_form/', data=data,
+                    HTTP_REFERER='/render_form/', follow=True)
+        self.assertRedirects(response, '/success/')
+        self.assertContains(response, 'David, avsd05@gmail.com')
+
+        # The view is not called, so nothing is stored in session
+        response = self.client.post('/process_form/', data=data,
+                    HTTP_REFERER='/render_form/', follow=True)
+        self.assertRedirects(response, '/success/')
+        self.assertContains(response, 'No data')
+
+    def test_duplicate_in_progress(self):
+        """Duplicate should wait for the original submission to finish"""
+        token = '11111111111111111111111111111111'
+        data = {'name': 'David', 'email': 'avsd05@gmail.com',
+                'popup_form_token': token}
+
+        # Simulate original submission, finished in 0.2 seconds
+        self.assertEqual(tokens.claim(token), None)
+        timer = threading.Timer(0.2, tokens.store, [token, '/success/'])
+        timer.start()
+        response = self.client.post('/process_form/', data=data,
+                    HTTP_REFERER='/render_form/', follow=True)
+        timer.join()
+        self.assertRedirects(response, '/success/')
+        self.assertContains(response, 'No data')
+
+    @override_settings(POPUP_FORMS_TOKEN_WAIT=0.1)
+    def test_duplicate_wait_timeout(self):
+        """Duplicate should not wait for the original submission forever"""
+        token = '22222222222222222222222222222222'
+        data = {'name': 'David', 'email': 'avsd05@gmail.com',
+                'popup_form_token': token}
+        self.assertEqual(tokens.claim(token), None)
+        response = self.client.post('/process_form/', data=data,
+                    HTTP_REFERER='/render_form/')
+        self.assertRedirects(response, '/render_form/')
+
+    def test_resubmit_after_errors(self):
+        """Corrected form should be processed with the same token"""
+        token = '33333333333333333333333333333333'
+        response = self.client.post('/process_form/',
+                    data={'name': 'David', 'email': 'wrongemail',
+                          'popup_form_token': token},
+                    HTTP_REFERER='/render_form/', follow=True)
+        self.assertContains(response, 'Enter a valid e-mail address.')
+        response = self.client.post('/process_form/',
+                    data={'name': 'David', 'email': 'avsd05@gmail.com',
+                          'popup_form_token': token},
+                    HTTP_REFERER='/render_form/', follow=True)
+        self.assertRedirects(response, '/success/')
+        self.assertContains(response, 'David, avsd05@gmail.com')
+
+    @override_settings(POPUP_FORMS_TOKEN=False)
+    def test_tokens_disabled(self):
+        """Duplicates should be processed, if tokens are not enabled"""
+        data = {'name': 'David', 'email': 'avsd05@gmail.com',
+                'popup_form_token': 'fedcba9876543210fedcba9876543210'}
+        for i in range(2):
+            response = self.client.post('/process_form/', data=data,
+                        HTTP_REFERER='/render_form/', follow=True)
+            self.assertContains(response, 'David, avsd05@gmail.com')
+
+    def test_release_on_error(self):
+        """Token should be released, if the view fails, to allow retry"""
+        data = {'name': 'David', 'email': 'avsd05@gmail.com',
+                'popup_form_token': '00112233445566778899aabbccddeeff'}
+        del FAILED_ONCE[:]
+        self.assertRaises(RuntimeError, self.client.post, '/flaky_form/',
+                          data=data, HTTP_REFERER='/render_form/')
+        response = self.client.post('/flaky_form/', data=data,
+                    HTTP_REFERER='/render_form/', follow=True)
+        self.assertRedirects(response, '/success/')
+        self.assertContains(response, 'David, avsd05@gmail.com')
+
+    def test_invalid_token(self):
+        """Malformed token should be ignored"""
+        data = {'name': 'David', 'email': 'avsd05@gmail.com',
+                'popup_form_token': 'not a token'}
+        for i in range(2):
+            response = self.client.post('/process_form/', data=data,
+                        HTTP_REFERER='/render_form/', follow=True)
+            self.assertContains(response, 'David, avsd05@gmail.com')
+
+
 @skip('TODO: Write test!')
 class TestTokenVarExtractor(test.TestCase):
     """Unittest for TokenVarExtractor """
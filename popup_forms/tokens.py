@@ -0,0 +1,115 @@
+"""Submission tokens, dropping duplicate popup form submissions.
+
+Enabled by setting ``POPUP_FORMS_TOKEN = True``. Then each popup form
+is rendered with unique hidden token, and `popup_forms.handler`
+processes only the first submission with the token. Duplicates
+(double-clicks, retries) are redirected to the same URL as the
+original submission, without calling the view. If the original
+submission is still being processed, the duplicate waits for it.
+Submissions with form errors are not remembered, so the form could be
+corrected and submitted again.
+
+Settings::
+
+  POPUP_FORMS_TOKEN           Render submission tokens (default: False)
+  POPUP_FORMS_TOKEN_TIMEOUT   Seconds to remember the token (default: 60)
+  POPUP_FORMS_TOKEN_WAIT      Seconds for duplicate to wait for the original
+                              submission to be processed (default: 5)
+  POPUP_FORMS_TOKEN_CACHE     Cache backend alias (default: 'default').
+                              Should be shared by all processes: local
+                              memory cache drops duplicates only within
+                              the same process.
+
+"""
+import re
+import time
+from copy import deepcopy
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+TOKEN_FIELD = 'popup_form_token'
+CACHE_PREFIX = 'popup_forms:token:'
+TOKEN_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# Stored while original submission is being processed
+IN_PROGRESS = ''
+
+# Seconds between checks of the original submission being processed
+POLL_INTERVAL = 0.05
+
+
+def tokens_enabled():
+    return getattr(settings, 'POPUP_FORMS_TOKEN', False)
+
+
+def new_token():
+    """Returns new submission token for rendering the form"""
+    return uuid4().hex
+
+
+def get_token(request):
+    """Returns valid submission token from POST data, or `None`"""
+    token = request.POST.get(TOKEN_FIELD)
+    if token and TOKEN_RE.match(token):
+        return token
+    return None
+
+
+# Tuples (config, backend) by alias: `get_cache` creates new backend
+# on each call, so it's re-created only if the CACHES setting changes
+_caches = {}
+
+
+def _cache():
+    alias = getattr(settings, 'POPUP_FORMS_TOKEN_CACHE', 'default')
+    config = settings.CACHES.get(alias)
+    cached = _caches.get(alias)
+    if cached is None or cached[0] != config:
+        cached = _caches[alias] = (deepcopy(config), get_cache(alias))
+    return cached[1]
+
+
+def _timeout():
+    return getattr(settings, 'POPUP_FORMS_TOKEN_TIMEOUT', 60)
+
+
+def _wait():
+    return getattr(settings, 'POPUP_FORMS_TOKEN_WAIT', 5)
+
+
+def claim(token):
+    """Marks the token as used.
+
+    Returns `None` if the token is seen first time (or released by the
+    original submission), and the submission should be processed.
+    Otherwise returns redirect URL of the original submission, waiting
+    up to POPUP_FORMS_TOKEN_WAIT seconds for it to be processed, or
+    `IN_PROGRESS`, if it is still not processed.
+
+    """
+    cache = _cache()
+    key = CACHE_PREFIX + token
+    deadline = time.time() + _wait()
+    while True:
+        if cache.add(key, IN_PROGRESS, _timeout()):
+            return None
+        redirect_to = cache.get(key)
+        if redirect_to:
+            return redirect_to
+        if redirect_to is None:
+            continue  # Released (or expired) meanwhile: claim it again
+        if time.time() >= deadline:
+            return IN_PROGRESS
+        time.sleep(POLL_INTERVAL)
+
+
+def store(token, redirect_to):
+    """Remembers redirect URL of processed submission"""
+    _cache().set(CACHE_PREFIX + token, redirect_to, _timeout())
+
+
+def release(token):
+    """Forgets the token, so the submission could be processed again"""
+    _cache().delete(CACHE_PREFIX + token)
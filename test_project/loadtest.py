@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+"""Load-test harness for popup forms over the test project.
+
+Runs a realistic mix of requests against the views defined in
+`popup_forms.tests`, from many threads at once, calling Django's
+WSGI handler in-process (no network, no separate server):
+
+  * page views            GET of a page rendering a popup form
+  * valid submissions     POST to `handler`-decorated view, redirect
+                          to the success page (`CloseFormResponse`)
+  * invalid submissions   POST with errors, redirect back to the page
+                          re-populating the form (`OpenFormResponse`)
+
+The whole mix is repeated for each session storage configuration,
+and throughput, latency percentiles and session read/write counts
+are reported for each of them.
+
+Usage::
+
+    cd test_project
+    python loadtest.py [--threads=N] [--requests=N] [--engine=...]
+
+"""
+
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from Cookie import SimpleCookie
+from cStringIO import StringIO
+from optparse import OptionParser
+from urllib import urlencode
+from urlparse import urlparse
+
+# Add parent dir to paths
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_project.settings')
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+from popup_forms.testcases import CallCounter
+
+
+DEFAULT_ENGINES = ('django.contrib.sessions.backends.db',
+                   'django.contrib.sessions.backends.cache',
+                   'django.contrib.sessions.backends.cached_db',
+                   'django.contrib.sessions.backends.file',)
+
+# Relative weights of the operations in the request mix
+DEFAULT_MIX = (('page_view', 70),
+               ('valid_submit', 20),
+               ('invalid_submit', 10))
+
+VALID_DATA = {'name': 'David', 'email': 'avsd05@gmail.com'}
+INVALID_DATA = {'name': 'David', 'email': 'wrongemail'}
+
+
+def percentile(values, percent):
+    """Returns percentile of sorted list of values (nearest rank)"""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class WSGIClient(object):
+    """Minimal in-process WSGI client with its own cookie jar.
+
+    Unlike `django.test.client.Client`, it doesn't connect signal
+    receivers for each request, so every thread could use its own client
+    with shared `WSGIHandler`: exceptions and responses are never mixed
+    up between threads.
+
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.cookies = SimpleCookie()
+
+    def request(self, method, path, data=None, referer=None):
+        """Makes single request. Returns tuple (status, headers, content)."""
+        body = urlencode(data or {})
+        path, sep, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_COOKIE': '; '.join('{0}={1}'.format(key, morsel.value)
+                                     for key, morsel in self.cookies.items()),
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': StringIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if referer:
+            environ['HTTP_REFERER'] = referer
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split()[0]), headers]
+
+        result = self.handler(environ, start_response)
+        try:
+            content = ''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()  # Sends `request_finished` signal
+
+        status, headers = started
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                self.cookies.load(value)
+        return status, dict((name.lower(), value)
+                            for name, value in headers), content
+
+    def fetch(self, method, path, data=None, referer=None):
+        """Makes request, following redirects as browser does.
+        Returns tuple (status, content) of the final response.
+
+        """
+        if method == 'POST':
+            data = dict(data or {})
+            csrf_cookie = self.cookies.get(settings.CSRF_COOKIE_NAME)
+            if csrf_cookie:
+                data['csrfmiddlewaretoken'] = csrf_cookie.value
+        status, headers, content = self.request(method, path, data, referer)
+        while status in (301, 302, 303):
+            location = urlparse(headers['location'])
+            path = location.path + ('?' + location.query
+                                    if location.query else '')
+            status, headers, content = self.request('GET', path,
+                                                    referer=referer)
+        return status, content
+
+
+def run_operation(client, name):
+    """Performs operation of the mix. Returns `True` on expected result."""
+    if name == 'page_view':
+        status, content = client.fetch('GET', '/render_form/')
+        return status == 200 and 'style="display:none"' in content
+
+    if name == 'valid_submit':
+        status, content = client.fetch('POST', '/process_form/',
+                                       VALID_DATA, referer='/render_form/')
+        return status == 200 and 'David, avsd05@gmail.com' in content
+
+    if name == 'invalid_submit':
+        status, content = client.fetch('POST', '/process_form/',
+                                       INVALID_DATA, referer='/render_form/')
+        return status == 200 and 'style="display:none"' not in content
+
+    raise ValueError('Unknown operation: {0}'.format(name))
+
+
+def worker(handler, operations, results, errors, lock):
+    """Runs the list of operations, using own client (i.e. own session)"""
+    client = WSGIClient(handler)
+    timings = []
+    failed = []
+
+    # Get CSRF cookie before submitting forms (not timed)
+    try:
+        client.fetch('GET', '/render_form/')
+    except Exception, e:
+        failed.append('warm-up: {0!r}'.format(e))
+    for name in operations:
+        started = time.time()
+        try:
+            if not run_operation(client, name):
+                failed.append('{0}: unexpected response'.format(name))
+        except Exception, e:
+            failed.append('{0}: {1!r}'.format(name, e))
+        timings.append((name, time.time() - started))
+    with lock:
+        results.extend(timings)
+        errors.extend(failed)
+
+
+def run_engine(engine, threads, requests, mix, seed):
+    """Runs the request mix using given session engine. Returns stats."""
+    settings.SESSION_ENGINE = engine
+
+    rnd = random.Random(seed)
+    names = [name for name, weight in mix for i in xrange(weight)]
+    # Spread the remainder, so that exactly `requests` operations are run
+    per_thread, remainder = divmod(requests, threads)
+    plans = [[rnd.choice(names)
+              for i in xrange(per_thread + (t < remainder))]
+             for t in xrange(threads)]
+    plans = [plan for plan in plans if plan]
+
+    from django.core.handlers.wsgi import WSGIHandler
+    handler = WSGIHandler()
+
+    results, errors, lock = [], [], threading.Lock()
+    store_class = import_module(engine).SessionStore
+    with CallCounter(store_class, 'load') as reads, \
+         CallCounter(store_class, 'save') as writes:
+        started = time.time()
+        pool = [threading.Thread(target=worker,
+                                 args=(handler, plan, results,
+                                       errors, lock))
+                for plan in plans]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.time() - started
+
+    return {'engine': engine,
+            'elapsed': elapsed,
+            'results': results,
+            'errors': errors,
+            'reads': reads.count,
+            'writes': writes.count}
+
+
+def report(stats, out=sys.stdout):
+    """Writes report of one engine run"""
+    results = stats['results']
+    total = len(results)
+    out.write('\n{0}\n{1}\n'.format(stats['engine'],
+                                    '-' * len(stats['engine'])))
+    out.write('  operations: {0} in {1:.2f}s, {2:.1f} ops/s\n'.format(
+        total, stats['elapsed'], total / (stats['elapsed'] or 1)))
+    out.write('  session:    {0} reads, {1} writes '
+              '({2:.2f} / {3:.2f} per operation)\n'.format(
+                  stats['reads'], stats['writes'],
+                  stats['reads'] / float(total or 1),
+                  stats['writes'] / float(total or 1)))
+    out.write('  errors:     {0}\n'.format(len(stats['errors'])))
+    for error in stats['errors'][:5]:
+        out.write('    {0}\n'.format(error))
+
+    out.write('  {0:<16}{1:>8}{2:>10}{3:>10}{4:>10}{5:>10}\n'.format(
+        'latency, ms', 'count', 'p50', 'p90', 'p99', 'max'))
+    names = [name for name, weight in DEFAULT_MIX] + ['all']
+    for name in names:
+        timings = sorted(t * 1000 for n, t in results
+                         if name == 'all' or n == name)
+        if not timings:
+            continue
+        out.write('  {0:<16}{1:>8}{2:>10.2f}{3:>10.2f}{4:>10.2f}'
+                  '{5:>10.2f}\n'.format(name, len(timings),
+                                        percentile(timings, 50),
+                                        percentile(timings, 90),
+                                        percentile(timings, 99),
+                                        timings[-1]))
+
+
+def setup_environment(temp_dir):
+    """Points the test project to popup forms test views and test DB.
+    Returns the original database name, to destroy the test DB.
+
+    """
+    settings.ROOT_URLCONF = 'popup_forms.tests'
+    settings.POPUP_FORMS = ('popup_forms.tests.PopupForm',)
+    settings.DEBUG = False
+    settings.TEMPLATE_DEBUG = False
+    settings.ALLOWED_HOSTS = ['testserver']
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.dummy.EmailBackend'
+    settings.SESSION_FILE_PATH = temp_dir
+
+    # Use file-based test database, shared by all threads
+    test_db = os.path.join(temp_dir, 'loadtest.sqlite')
+    settings.DATABASES['default']['TEST_NAME'] = test_db
+
+    from django.db import connection
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    return old_name
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-t', '--threads', type='int', default=10,
+                      help='Number of concurrent clients [%default]')
+    parser.add_option('-n', '--requests', type='int', default=1000,
+                      help='Total number of operations per engine [%default]')
+    parser.add_option('-e', '--engine', action='append', dest='engines',
+                      help='Session engine to test, could be repeated '
+                           '[all of: {0}]'.format(', '.join(DEFAULT_ENGINES)))
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='Random seed for the request mix [%default]')
+    options, args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix='popup_forms_')
+    old_name = None
+    try:
+        old_name = setup_environment(temp_dir)
+        for engine in options.engines or DEFAULT_ENGINES:
+            stats = run_engine(engine, options.threads, options.requests,
+                               DEFAULT_MIX, options.seed)
+            report(stats)
+    finally:
+        if old_name is not None:
+            from django.db import connection
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()